@@ -2,6 +2,13 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 import bcrypt
+import hashlib
+import os
+import tempfile
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.pagesizes import A4
@@ -13,6 +20,14 @@ from datetime import datetime
 # =========================
 ADMIN_EMAIL = "michellemagdalene885@gmail.com"
 FREE_USAGE_LIMIT = 3
+CACHE_DIR = "cache"
+CACHE_MAX_AGE = 24 * 60 * 60  # seconds since an upload was last used
+CSV_BLOCK_SIZE = 16 << 20
+
+# Lowercase keywords used to auto-detect the column mapping
+DATE_KWS = ("date",)
+SALES_KWS = ("sales", "revenue")
+PROFIT_KWS = ("profit",)
 
 # =========================
 # PAGE CONFIG
@@ -36,26 +51,34 @@ st.divider()
 # =========================
 # DATABASE
 # =========================
-conn = sqlite3.connect("users.db", check_same_thread=False)
-c = conn.cursor()
+@st.cache_resource
+def get_conn():
+    conn = sqlite3.connect("users.db", check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        email TEXT PRIMARY KEY,
+        password BLOB,
+        usage_count INTEGER DEFAULT 0,
+        created_at TEXT
+    )
+    """)
+    conn.commit()
+    return conn
 
-c.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    email TEXT PRIMARY KEY,
-    password BLOB,
-    usage_count INTEGER DEFAULT 0,
-    created_at TEXT
-)
-""")
-conn.commit()
+conn = get_conn()
 
 # =========================
 # AUTH FUNCTIONS
 # =========================
 def create_user(email, password):
+    if conn.execute("SELECT 1 FROM users WHERE email=?", (email,)).fetchone():
+        return False
     hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
     try:
-        c.execute(
+        conn.execute(
             "INSERT INTO users (email, password, usage_count, created_at) VALUES (?,?,0,?)",
             (email, hashed, datetime.now().isoformat())
         )
@@ -65,21 +88,22 @@ def create_user(email, password):
         return False
 
 def login_user(email, password):
-    c.execute("SELECT password FROM users WHERE email=?", (email,))
-    data = c.fetchone()
+    data = conn.execute("SELECT password FROM users WHERE email=?", (email,)).fetchone()
     return data and bcrypt.checkpw(password.encode(), data[0])
 
 def increment_usage(email):
-    c.execute("UPDATE users SET usage_count = usage_count + 1 WHERE email=?", (email,))
+    conn.execute("UPDATE users SET usage_count = usage_count + 1 WHERE email=?", (email,))
     conn.commit()
 
 def get_usage(email):
-    c.execute("SELECT usage_count FROM users WHERE email=?", (email,))
-    return c.fetchone()[0]
+    return conn.execute("SELECT usage_count FROM users WHERE email=?", (email,)).fetchone()[0]
 
-def get_all_users():
-    c.execute("SELECT email, usage_count, created_at FROM users")
-    return c.fetchall()
+@st.cache_data(ttl=30)
+def load_users_df():
+    return pd.read_sql_query(
+        'SELECT email AS "Email", usage_count AS "Usage Count", created_at AS "Registered On" FROM users',
+        get_conn()
+    )
 
 # =========================
 # SESSION
@@ -96,9 +120,11 @@ if not st.session_state.logged_in:
     t1, t2 = st.tabs(["Login", "Register"])
 
     with t1:
-        email = st.text_input("Email")
-        password = st.text_input("Password", type="password")
-        if st.button("Login"):
+        with st.form("login"):
+            email = st.text_input("Email")
+            password = st.text_input("Password", type="password")
+            submitted = st.form_submit_button("Login")
+        if submitted:
             if login_user(email, password):
                 st.session_state.logged_in = True
                 st.session_state.user = email
@@ -107,9 +133,11 @@ if not st.session_state.logged_in:
                 st.error("Invalid credentials")
 
     with t2:
-        new_email = st.text_input("New Email")
-        new_password = st.text_input("New Password", type="password")
-        if st.button("Register"):
+        with st.form("register"):
+            new_email = st.text_input("New Email")
+            new_password = st.text_input("New Password", type="password")
+            registered = st.form_submit_button("Register")
+        if registered:
             if create_user(new_email, new_password):
                 st.success("Account created. Please login.")
             else:
@@ -131,12 +159,10 @@ if st.sidebar.button("Logout"):
 # =========================
 if st.session_state.user == ADMIN_EMAIL:
     st.sidebar.markdown("### 👑 Admin Panel")
-    users = get_all_users()
+    df_users = load_users_df()
     st.subheader("📊 Registered Users (Admin Only)")
-    st.metric("Total Users", len(users))
-    st.dataframe(
-        pd.DataFrame(users, columns=["Email", "Usage Count", "Registered On"])
-    )
+    st.metric("Total Users", len(df_users))
+    st.dataframe(df_users)
 
 st.divider()
 
@@ -150,6 +176,81 @@ if usage >= FREE_USAGE_LIMIT and st.session_state.user != ADMIN_EMAIL:
     st.info("📧 Contact admin for access: michellemagdalene885@gmail.com")
     st.stop()
 
+# =========================
+# FILE LOADING
+# =========================
+def dedupe_columns(names):
+    # Same ".1", ".2" suffixes pandas gives repeated headers
+    seen, out = set(), []
+    for name in names:
+        new, k = name, 0
+        while new in seen:
+            k += 1
+            new = f"{name}.{k}"
+        seen.add(new)
+        out.append(new)
+    return out
+
+def frame_to_table(df):
+    # Headers like 1 and "1" only collide once converted to str
+    df.columns = dedupe_columns(df.columns.map(str))
+    # Mixed-type columns (common in Excel) can't be converted to Arrow as-is
+    mixed = [col for col in df.columns if df[col].dtype == object]
+    df[mixed] = df[mixed].astype("string")
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def parse_upload(name, data):
+    if name.endswith(".csv"):
+        try:
+            table = csv.read_csv(
+                pa.BufferReader(data),
+                read_options=csv.ReadOptions(block_size=CSV_BLOCK_SIZE, use_threads=True)
+            )
+            return table.rename_columns(dedupe_columns(table.column_names))
+        except pa.ArrowInvalid:
+            # Arrow can reject a cell that doesn't fit the type it inferred
+            # for the column; pandas' reader copes with those files
+            return frame_to_table(pd.read_csv(BytesIO(data)))
+    return frame_to_table(pd.read_excel(BytesIO(data), engine="calamine"))
+
+def prune_cache():
+    cutoff = time.time() - CACHE_MAX_AGE
+    for entry in os.scandir(CACHE_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def cache_upload(name, data):
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    path = os.path.join(CACHE_DIR, f"{digest}.parquet")
+    try:
+        # Refresh the age of a cached upload so it isn't pruned while in use
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    prune_cache()
+    table = parse_upload(name, data)
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as tmp:
+        pq.write_table(table, tmp)
+    os.replace(tmp.name, path)
+    return path
+
+def load_preview(path, n=5):
+    with pq.ParquetFile(path) as pf:
+        batch = next(pf.iter_batches(batch_size=n), None)
+        if batch is None:
+            return pf.schema_arrow.empty_table().to_pandas()
+        return batch.to_pandas()
+
+@st.cache_data(show_spinner=False)
+def load_df(path, columns):
+    return pd.read_parquet(path, columns=columns, dtype_backend="pyarrow")
+
 # =========================
 # FILE UPLOAD
 # =========================
@@ -158,49 +259,26 @@ file = st.file_uploader("📤 Upload Sales Data (CSV / Excel)", ["csv", "xlsx"])
 if not file:
     st.stop()
 
-increment_usage(st.session_state.user)
+# Count each upload once, not every rerun while the file stays selected
+if st.session_state.get("counted_file") != file.file_id:
+    increment_usage(st.session_state.user)
+    st.session_state.counted_file = file.file_id
 
-df = pd.read_csv(file) if file.name.endswith(".csv") else pd.read_excel(file)
-st.dataframe(df.head())
+path = cache_upload(file.name, file.getvalue())
+preview = load_preview(path)
+st.dataframe(preview)
 
 # =========================
 # COLUMN AUTO-DETECT
 # =========================
-def find_column(cols, keywords):
-    for col in cols:
-        for k in keywords:
-            if k.lower() in col.lower():
-                return col
-    return cols[0]
-
-cols = df.columns.tolist()
-
-date_col = st.selectbox("Date", cols, index=cols.index(find_column(cols, ["date"])))
-sales_col = st.selectbox("Sales", cols, index=cols.index(find_column(cols, ["sales", "revenue"])))
-profit_col = st.selectbox("Profit", cols, index=cols.index(find_column(cols, ["profit"])))
-
-# =========================
-# CLEANING
-# =========================
-df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-df[sales_col] = pd.to_numeric(df[sales_col], errors="coerce")
-df[profit_col] = pd.to_numeric(df[profit_col], errors="coerce")
-df.dropna(inplace=True)
-
-# =========================
-# KPIs
-# =========================
-total_sales = df[sales_col].sum()
-total_profit = df[profit_col].sum()
-
-c1, c2 = st.columns(2)
-c1.metric("💰 Total Sales", f"₹{total_sales:,.2f}")
-c2.metric("📈 Total Profit", f"₹{total_profit:,.2f}")
+def find_column(lc_cols, keywords):
+    return next((i for i, cl in enumerate(lc_cols) for k in keywords if k in cl), 0)
 
 # =========================
 # PDF REPORT
 # =========================
-def generate_pdf():
+@st.cache_data(show_spinner=False)
+def generate_pdf(total_sales, total_profit):
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
     styles = getSampleStyleSheet()
@@ -212,12 +290,60 @@ def generate_pdf():
     elements.append(Paragraph(f"Total Profit: ₹{total_profit:,.2f}", styles["Normal"]))
 
     doc.build(elements)
-    buffer.seek(0)
-    return buffer
-
-st.download_button(
-    "📄 Download Report",
-    generate_pdf(),
-    "M2SolAnalytics_Report.pdf",
-    "application/pdf"
-)
+    return buffer.getvalue()
+
+# =========================
+# ANALYSIS
+# =========================
+# Runs as a fragment so changing a column mapping reruns only this block,
+# not the upload, usage count and preview above it
+@st.fragment
+def analysis_block(path, cols):
+    lc_cols = [str(col).lower() for col in cols]
+
+    date_col = st.selectbox("Date", cols, index=find_column(lc_cols, DATE_KWS))
+    sales_col = st.selectbox("Sales", cols, index=find_column(lc_cols, SALES_KWS))
+    profit_col = st.selectbox("Profit", cols, index=find_column(lc_cols, PROFIT_KWS))
+
+    # Fragment reruns skip cache_upload, so keep the file's age fresh here too;
+    # if it was pruned meanwhile, a full rerun writes it again from the upload
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        st.rerun()
+
+    df = load_df(path, list(dict.fromkeys([date_col, sales_col, profit_col])))
+
+    # Cleaning: the pyarrow CSV reader already parses ISO dates while tokenizing
+    dates = df[date_col]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors="coerce")
+
+    df = df.assign(**{
+        date_col: dates,
+        # float64 so unparseable cells become NaN that dropna removes; on
+        # Arrow-backed strings to_numeric yields NaN values, not nulls
+        sales_col: pd.to_numeric(df[sales_col], errors="coerce").astype("float64"),
+        profit_col: pd.to_numeric(df[profit_col], errors="coerce").astype("float64"),
+    }).dropna(subset=[date_col, sales_col, profit_col])
+
+    if df.empty:
+        st.error("No valid rows found for the selected Date / Sales / Profit columns")
+        return
+
+    # KPIs
+    totals = df[[sales_col, profit_col]].sum()
+    total_sales, total_profit = float(totals.iloc[0]), float(totals.iloc[1])
+
+    c1, c2 = st.columns(2)
+    c1.metric("💰 Total Sales", f"₹{total_sales:,.2f}")
+    c2.metric("📈 Total Profit", f"₹{total_profit:,.2f}")
+
+    st.download_button(
+        "📄 Download Report",
+        lambda: generate_pdf(total_sales, total_profit),
+        "M2SolAnalytics_Report.pdf",
+        "application/pdf"
+    )
+
+analysis_block(path, preview.columns.tolist())